@@ -10,33 +10,169 @@ tunnel if the tunnel dies for any reason.
 
 # System imports
 import ast
-import io
+import functools
+import json
 import logging
 import os
-import pprint
+import signal
+import socket
 import sys
-import time
+import threading
 
 # from contextlib import redirect_stdout
 
 # External imports
-import sshtunnel
+# sshtunnel (and paramiko / cryptography behind it) is imported in
+# start_tunnel once the config is known to be valid.
 
 logger = logging.getLogger(__name__)
 
+# Name to level mapping, public since Python 3.11, before that the protected
+# member access will have to continue.
+try:
+    _LEVELS = logging.getLevelNamesMapping()
+except AttributeError:
+    _LEVELS = logging._nameToLevel.copy() # pylint: disable=protected-access
+
+# Container configuration is fixed at start up, so the environment is copied
+# once. setup_logging scans every variable for log_level_ overrides anyway and
+# parse_config reads from the same copy instead of decoding through os.environ
+# again.
+_ENV = os.environ.copy()
+
+# Private key mounted into the container for public key authentication
+PRIVATE_KEY_FILE = '/private.key'
+
+# Longest time between tunnel checks, matches the SSH keepalive interval.
+TUNNEL_CHECK_INTERVAL = 30.0
+# Set to stop watching the tunnel, on SIGTERM, a remote side error or the SSH
+# transport going away.
+_stop = threading.Event()
+
+# Logged by SSHTunnel when a forward can not reach the remote side:
+# 'Could not establish connection from local {0} to remote {1} side of the tunnel: {2}'
+# (the remote address sits in the middle, older releases had no address).
+REMOTE_SIDE_ERROR = 'side of the tunnel'
+# The logger SSHTunnel emits REMOTE_SIDE_ERROR on.
+SSHTUNNEL_LOGGER = 'sshtunnel.SSHTunnelForwarder'
+
+class FastFormatter(logging.Formatter):
+    '''
+    Formatter caching the formatted timestamp for the current second.
+
+    When a date format is given it has no sub-second component so strftime
+    only needs to run once per wall-clock second instead of once per record.
+    '''
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # (second, formatted) kept as one tuple so threads never see a mix
+        self._last = (None, '')
+
+    def formatTime(self, record: logging.LogRecord, datefmt: str | None = None) -> str:
+        # Without datefmt the default format appends milliseconds
+        if datefmt is None:
+            return super().formatTime(record, datefmt)
+
+        second = int(record.created)
+        last_second, last_formatted = self._last
+        if second == last_second:
+            return last_formatted
+
+        formatted = super().formatTime(record, datefmt)
+        self._last = (second, formatted)
+        return formatted
+
+class RemoteErrorFilter(logging.Filter):
+    '''
+    Logging filter flagging remote side errors from SSHTunnel.
+
+    Sets event (a new one unless given) and matched as soon as a matching
+    record is logged, records are never dropped.
+    '''
+    def __init__(self, event: threading.Event | None = None) -> None:
+        super().__init__()
+        self.event = event or threading.Event()
+        self.matched = False
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if REMOTE_SIDE_ERROR in record.getMessage():
+            self.matched = True
+            self.event.set()
+        return True
+
+@functools.lru_cache(maxsize=16)
 def check_log_level(level: str, default_level: str = 'INFO') -> int:
     '''
     Vet the logging level sent in, based on info from:
     https://stackoverflow.com/questions/18846024/get-list-of-named-loglevels
 
-    Until a public / formal method exists for this the protected member access
-    will have to continue.
+    Uses the name to level mapping taken once at import time, see _LEVELS.
     '''
-    # pylint: disable=protected-access
-    if level in logging._nameToLevel:
-        return logging._nameToLevel[level]
+    return _LEVELS.get(level, _LEVELS[default_level])
+
+@functools.cache
+def resolve_host(host: str, port: int) -> str:
+    '''
+    Resolve host to the first address returned by getaddrinfo (IPv4 or IPv6).
+    '''
+    return socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][4][0]
+
+def is_bind_pair(value) -> bool:
+    '''
+    Check if value is a single (host, port) pair rather than a list of them.
+    '''
+    return (
+        isinstance(value, (list, tuple))
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], int)
+        and not isinstance(value[1], bool)
+    )
 
-    return logging._nameToLevel[default_level]
+def parse_bind_addresses(bind_addresses: str) -> list[tuple[str, int] | str]:
+    '''
+    Parse a list of bind addresses, e.g. [("127.0.0.1", 80),("127.0.0.1", 3306)]
+
+    JSON values are decoded with the json module, python literal parsing is
+    only used as a fallback for python style values such as tuples. Either way
+    (host, port) pairs come back as tuples, a lone pair is wrapped in a list and
+    anything else, such as a UNIX socket path, is left as is.
+    '''
+    try:
+        parsed = json.loads(bind_addresses)
+    except json.JSONDecodeError:
+        parsed = ast.literal_eval(bind_addresses)
+
+    if is_bind_pair(parsed):
+        return [tuple(parsed)]
+
+    if not isinstance(parsed, (list, tuple)):
+        parsed = [parsed]
+
+    return [tuple(x) if isinstance(x, (list, tuple)) else x for x in parsed]
+
+@functools.cache
+def have_private_key() -> bool:
+    '''
+    Check if a private key file is mounted, the answer can't change for the
+    lifetime of the container.
+
+    Docker creates a directory when the host side of a bind mount is missing
+    so check for a regular file.
+    '''
+    return os.path.isfile(PRIVATE_KEY_FILE)
+
+def log_level_module_name(env_key: str) -> str:
+    '''
+    Convert a log_level_<module name> variable name to the module name.
+
+    Shells don't allow dots in variable names so a single underscore stands
+    for a dot and a double underscore for a literal underscore, e.g.
+    log_level_paramiko_auth__handler is paramiko.auth_handler.
+    '''
+    return '_'.join(
+        part.replace('_', '.') for part in env_key[len('log_level_'):].split('__')
+    )
 
 def setup_logging() -> None:
     '''
@@ -46,22 +182,47 @@ def setup_logging() -> None:
     date_format = '%Y-%m-%d %H:%M:%S' # ISO format
     log_level_default = 'INFO'
 
-    log_level = os.environ.get("log_level", log_level_default)
+    log_level = _ENV.get("log_level", log_level_default)
     log_level_value = check_log_level(log_level, default_level=log_level_default)
 
-    #TODO: allow the user to set any underlying modules / packages logging levels.
-    # Current thoughts on the matter, allow the definition of variable:
-    # log_level_<module name> = ERROR
-    # for example log_level_paramiko would then translate to:
-    # logging.getLogger('paramiko').setLevel(logging.ERROR)
-    logging.getLogger('paramiko.transport').setLevel(logging.ERROR)
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(FastFormatter(log_format, date_format))
 
     logging.basicConfig(
-        format=log_format,
-        datefmt=date_format,
+        handlers=[log_handler],
         level=log_level_value,
     )
 
+    # Paramiko logs every packet at DEBUG, keep it quiet unless the user
+    # explicitly asks for it via a log_level_<module name> override below.
+    logging.getLogger('paramiko').setLevel(logging.WARNING)
+    logging.getLogger('paramiko.transport').setLevel(logging.ERROR)
+    # SSHTunnel's own default, its logger is handed to open_tunnel so the
+    # library doesn't reset the level (see start_tunnel).
+    logging.getLogger('sshtunnel').setLevel(logging.ERROR)
+
+    # Allow the user to set any underlying modules / packages logging levels
+    # by defining the variable:
+    # log_level_<module name> = ERROR
+    # for example log_level_paramiko would then translate to:
+    # logging.getLogger('paramiko').setLevel(logging.ERROR)
+    # See log_level_module_name for how the module name is spelled.
+    # The environment is scanned once so any module name can be used.
+    for env_key, env_value in _ENV.items():
+        if env_key.startswith('log_level_'):
+            module_name = log_level_module_name(env_key)
+            if not module_name:
+                continue # log_level_ on its own would change the root logger
+            logging.getLogger(module_name).setLevel(
+                check_log_level(env_value, default_level=log_level_default)
+            )
+
+    # Logger filters only see records that pass the logger's level, keep the
+    # remote side errors flowing so RemoteErrorFilter can act on them.
+    sshtunnel_logger = logging.getLogger(SSHTUNNEL_LOGGER)
+    if sshtunnel_logger.getEffectiveLevel() > logging.ERROR:
+        sshtunnel_logger.setLevel(logging.ERROR)
+
 def parse_config() -> dict[str,str]:
     '''
     Parse config data.
@@ -69,42 +230,57 @@ def parse_config() -> dict[str,str]:
     Scan and parse environment and produce argument dictionary to pass to
     sshtunnel's open_tunnel function.
     '''
-    tunnel_params = {}
+    env = _ENV
 
     # Mandatory items
-    ssh_host = os.environ.get("ssh_host")
-    ssh_port = int(os.environ.get("ssh_port"))
-    ssh_username = os.environ.get("ssh_username")
-
-    tunnel_params['ssh_address_or_host'] = tuple([ssh_host, ssh_port])
-    tunnel_params['ssh_username'] = ssh_username
-    tunnel_params['set_keepalive'] = 30.0
+    ssh_host = env.get("ssh_host")
+    ssh_port = int(env.get("ssh_port"))
+    ssh_username = env.get("ssh_username")
+
+    # The hostname is normally handed to paramiko as is, resolving it early is
+    # opt-in for those who want DNS failures to be caught before connecting.
+    if env.get("ssh_resolve_early") == '1':
+        if not ssh_host:
+            # getaddrinfo would quietly resolve a missing host to loopback
+            logging.error("SSH host not provided, quitting...")
+            sys.exit(-1)
+        try:
+            ssh_host = resolve_host(ssh_host, ssh_port)
+        except socket.gaierror as exc:
+            logging.error("Unable to resolve SSH host '%s': %s, quitting...", ssh_host, exc)
+            sys.exit(-1)
 
-    private_key_file = "/private.key"
-    if os.path.exists(private_key_file):
+    auth_params = {}
+    if have_private_key():
         logging.debug("Private key present - using public key authentication")
-        tunnel_params['ssh_pkey'] = private_key_file
+        auth_params['ssh_pkey'] = PRIVATE_KEY_FILE
 
-        ssh_private_key_password = os.environ.get("ssh_private_key_password")
+        ssh_private_key_password = env.get("ssh_private_key_password")
         if ssh_private_key_password in [None, 'None']:
             pass # No key password
         else:
-            tunnel_params['ssh_private_key_password'] = ssh_private_key_password
+            auth_params['ssh_private_key_password'] = ssh_private_key_password
     else:
-        ssh_password = os.environ.get("ssh_password")
+        ssh_password = env.get("ssh_password")
         if ssh_password is None:
             logging.error("SSH Password not provided, quitting...")
             sys.exit(-1)
         else:
-            tunnel_params['ssh_password'] = ssh_password
+            auth_params['ssh_password'] = ssh_password
 
     # Tunnel forwards
-    remote_bind_addresses = os.environ.get("remote_bind_addresses")
-    local_bind_addresses = os.environ.get("local_bind_addresses")
-    tunnel_params['remote_bind_addresses'] = ast.literal_eval(remote_bind_addresses)
-    tunnel_params['local_bind_addresses']  = ast.literal_eval(local_bind_addresses)
-
-    return tunnel_params
+    remote_bind_addresses = env.get("remote_bind_addresses")
+    local_bind_addresses = env.get("local_bind_addresses")
+
+    # Built in one go so the dict is allocated at its final size
+    return {
+        'ssh_address_or_host': (ssh_host, ssh_port),
+        'ssh_username': ssh_username,
+        'set_keepalive': TUNNEL_CHECK_INTERVAL,
+        **auth_params,
+        'remote_bind_addresses': parse_bind_addresses(remote_bind_addresses),
+        'local_bind_addresses': parse_bind_addresses(local_bind_addresses),
+    }
 
 def start_tunnel() -> None:
     '''
@@ -112,22 +288,31 @@ def start_tunnel() -> None:
     '''
     setup_logging()
 
-    ### Setup the console handler with a StringIO object
-    log_capture_string = io.StringIO()
-    handler_ch = logging.StreamHandler(log_capture_string)
-    handler_ch.setLevel(logging.ERROR)
-
-    ### Add the console handler to the logger
-    logger.addHandler(handler_ch)
+    ### Watch SSHTunnel for remote side errors.
+    # Logger filters do not apply to child loggers so attach to the logger
+    # SSHTunnel actually emits on.
+    remote_error = RemoteErrorFilter(_stop)
+    logging.getLogger(SSHTUNNEL_LOGGER).addFilter(remote_error)
 
     tunnel_config = parse_config()
 
+    # pylint: disable=import-outside-toplevel
+    import sshtunnel
+
+    # Wake the tunnel check loop straight away so the tunnel is closed cleanly
+    signal.signal(signal.SIGTERM, lambda *_: _stop.set())
+
     logging.info("SSH Tunnel starting...")
-    # Potentally dangerous statement as passwords will be included
-    logging.debug("SSH Tunnel parameters:\n%s", pprint.pformat(tunnel_config))
+    if logger.isEnabledFor(logging.DEBUG):
+        import pprint
+        # Potentally dangerous statement as passwords will be included
+        logger.debug("SSH Tunnel parameters:\n%s", pprint.pformat(tunnel_config))
 
     try:
+        # Passing the logger stops SSHTunnel from creating its own, which would
+        # add a second console handler and overwrite any log_level_ override.
         with sshtunnel.open_tunnel(
+            logger=logging.getLogger(SSHTUNNEL_LOGGER),
             **tunnel_config
         ) as server:
             logging.info("SSH Tunnels established on %s@%s:%d\nbinds: '%s' => '%s'",
@@ -137,34 +322,53 @@ def start_tunnel() -> None:
                 tunnel_config['remote_bind_addresses'],
                 tunnel_config['local_bind_addresses'],
             )
-            while True:
-                check_tunnel(server, log_capture_string)
+            threading.Thread(
+                target=watch_transport, args=(server,), name='transport-watcher', daemon=True
+            ).start()
+
+            while not _stop.wait(timeout=TUNNEL_CHECK_INTERVAL):
+                check_tunnel(server)
+
+            if remote_error.matched:
+                logging.error("Problem with remote side, maybe the other side is unavailable, "
+                    "restarting...")
+                sys.exit(-2)
+
+            if not server.is_active:
+                logging.error("SSH transport is down, restarting...")
+                sys.exit(-1)
+
+            logging.info("SIGTERM received, stopping...")
+            sys.exit(0)
     except Exception as exc:
         logging.error("SSH Tunnel Failed %s", exc)
     finally:
         logging.warning("SSH Tunnel ended")
 
-def check_tunnel(server, stdout):
-    '''
-    Check status of tunnel
+def watch_transport(server) -> None:
     '''
-    #Check for remote side error from internal modules of Paramiko/SSHTunnel
-    out = stdout.getvalue()
+    Wake the tunnel check loop as soon as the SSH transport goes away.
 
-    if 'to remote side of the tunnel' in out:
-        logging.error("Problem with remote side, maybe the other side is unavailable, "
-            "restarting...")
+    Paramiko's transport is a thread, joining it only returns once the SSH
+    connection is closed.
+    '''
+    # pylint: disable=protected-access
+    server._transport.join()
+    _stop.set()
 
-        sys.exit(-2)
+def check_tunnel(server):
+    '''
+    Check status of tunnel
+    '''
+    if not server.is_active:
+        logging.error("SSH transport is down, restarting...")
+        sys.exit(-1)
 
     server.check_tunnels()
 
-    for ret in server.tunnel_is_up.values():
-        if ret is False:
-            logging.error("Tunnel is dead, restarting...")
-            sys.exit(-1)
-
-    time.sleep(1)
+    if not all(server.tunnel_is_up.values()):
+        logging.error("Tunnel is dead, restarting...")
+        sys.exit(-1)
 
 if __name__== "__main__":
     start_tunnel()
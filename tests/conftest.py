@@ -0,0 +1,22 @@
+'''
+Shared fixtures for the tests
+'''
+
+# System imports
+import importlib.util
+import pathlib
+
+# External imports
+import pytest
+
+@pytest.fixture(scope='session')
+def ssh_tunneller():
+    '''
+    The entrypoint module, it is __main__.py so it can't be imported by name
+    '''
+    spec = importlib.util.spec_from_file_location(
+        'ssh_tunneller', pathlib.Path(__file__).parent.parent / '__main__.py',
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,20 @@
+'''
+Tests for log_level_module_name
+'''
+
+# External imports
+import pytest
+
+@pytest.mark.parametrize('env_key, expected', [
+    ('log_level_paramiko', 'paramiko'),
+    ('log_level_paramiko_transport', 'paramiko.transport'),
+    ('log_level_sshtunnel_SSHTunnelForwarder', 'sshtunnel.SSHTunnelForwarder'),
+    ('log_level_paramiko_auth__handler', 'paramiko.auth_handler'),
+    ('log_level_____main____', '__main__'),
+    ('log_level_', ''),
+])
+def test_log_level_module_name(ssh_tunneller, env_key, expected):
+    '''
+    Single underscores map to dots, double underscores to an underscore
+    '''
+    assert ssh_tunneller.log_level_module_name(env_key) == expected
@@ -0,0 +1,32 @@
+'''
+Tests for parse_bind_addresses
+'''
+
+# External imports
+import pytest
+
+@pytest.mark.parametrize('value, expected', [
+    # Python style, as in the README
+    ('[("127.0.0.1", 80),("127.0.0.1", 3306)]', [('127.0.0.1', 80), ('127.0.0.1', 3306)]),
+    ("[('127.0.0.1', 80),('0.0.0.0', 3306)]", [('127.0.0.1', 80), ('0.0.0.0', 3306)]),
+    # JSON style
+    ('[["127.0.0.1", 80]]', [('127.0.0.1', 80)]),
+    # UNIX socket paths are kept as strings
+    ('["/tmp/db.sock"]', ['/tmp/db.sock']),
+    ('[("127.0.0.1", 80), "/tmp/db.sock"]', [('127.0.0.1', 80), '/tmp/db.sock']),
+    ('["/run/a(1).sock"]', ['/run/a(1).sock']),
+    ("['/run/a(1).sock']", ['/run/a(1).sock']),
+    # A lone pair is a single address
+    ('("127.0.0.1", 80)', [('127.0.0.1', 80)]),
+    ('["127.0.0.1", 80]', [('127.0.0.1', 80)]),
+    # Two socket paths are not a pair
+    ('["/tmp/a.sock", "/tmp/b.sock"]', ['/tmp/a.sock', '/tmp/b.sock']),
+    # Trailing comma is not JSON, the literal_eval fallback gives the same shape
+    ('[["a",1],]', [('a', 1)]),
+    ('[("a",1),]', [('a', 1)]),
+])
+def test_parse_bind_addresses(ssh_tunneller, value, expected):
+    '''
+    Bind addresses come back as a list of tuples or strings
+    '''
+    assert ssh_tunneller.parse_bind_addresses(value) == expected